@@ -1,10 +1,17 @@
 from __future__ import annotations
 
+import asyncio
+import heapq
 import os
 import time
-from typing import Any, Dict, List, Optional, Tuple
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from operator import itemgetter
+from typing import Any, Deque, Dict, List, Optional, Tuple
 from dotenv import load_dotenv
 import httpx
+import orjson
 
 load_dotenv() 
 # -------------
@@ -30,77 +37,263 @@ TOKEN_URL = (
     "auth/realms/opensky-network/protocol/openid-connect/token"
 )
 
-CLIENT_ID = os.getenv("OPENSKY_CLIENT_ID")
-CLIENT_SECRET = os.getenv("OPENSKY_CLIENT_SECRET")
 
-# Таймауты можно регулировать
-HTTP_TIMEOUT = float(os.getenv("OPENSKY_HTTP_TIMEOUT", "20"))
+# ---------------------------
+# Config
+# ---------------------------
+
+@dataclass(frozen=True, slots=True)
+class Config:
+    """Настройки из окружения (.env): читаются один раз при импорте."""
+
+    client_id: Optional[str]
+    client_secret: Optional[str]
+    # Таймауты можно регулировать
+    http_timeout: float
+    # Потолок одновременных запросов к API OpenSky
+    # (фактический лимит адаптивный, см. _AIMDLimiter)
+    max_concurrency: int
+    # Размер общего пула соединений
+    max_connections: int
+    # Сколько секунд переиспользовать одинаковый ответ OpenSky
+    # (state vectors обновляются примерно раз в 5–10 с; 0 — без кэша)
+    cache_ttl: float
+    # Порт HTTP-транспорта MCP
+    port: int
+
+    @property
+    def has_credentials(self) -> bool:
+        return bool(self.client_id and self.client_secret)
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        return cls(
+            client_id=os.getenv("OPENSKY_CLIENT_ID"),
+            client_secret=os.getenv("OPENSKY_CLIENT_SECRET"),
+            http_timeout=float(os.getenv("OPENSKY_HTTP_TIMEOUT", "20")),
+            # 0 и ниже не означают «без лимита» — лимитер с нулём слотов
+            # навсегда заблокировал бы каждый вызов
+            max_concurrency=max(1, int(os.getenv("OPENSKY_MAX_CONCURRENCY", "8"))),
+            # Пул без соединений отдаёт PoolTimeout на любой запрос
+            max_connections=max(1, int(os.getenv("OPENSKY_MAX_CONN", "100"))),
+            cache_ttl=float(os.getenv("OPENSKY_CACHE_TTL", "5")),
+            port=int(os.getenv("PORT", "8000")),
+        )
+
+
+CONFIG = Config.from_env()
 
 
 # ---------------------------
 # Demo regions presets (optional)
 # ---------------------------
 
-REGIONS: Dict[str, Tuple[float, float, float, float]] = {
-    "moscow": (55.20, 36.90, 56.10, 38.30),
-    "spb": (59.50, 29.70, 60.20, 31.20),
-    "komi": (58.90, 44.90, 68.70, 66.70),
-    "komi_wide": (58.50, 44.00, 69.20, 67.20),
+def _bbox(lamin: float, lomin: float, lamax: float, lomax: float) -> Dict[str, float]:
+    """bbox в виде параметров запроса OpenSky /states/all."""
+    return {"lamin": lamin, "lomin": lomin, "lamax": lamax, "lomax": lomax}
+
+
+# Пресеты хранятся сразу как готовые параметры запроса — без распаковки
+# и повторной сборки на каждый вызов. Объекты общие: не мутировать.
+REGIONS: Dict[str, Dict[str, float]] = {
+    "moscow": _bbox(55.20, 36.90, 56.10, 38.30),
+    "spb": _bbox(59.50, 29.70, 60.20, 31.20),
+    "komi": _bbox(58.90, 44.90, 68.70, 66.70),
+    "komi_wide": _bbox(58.50, 44.00, 69.20, 67.20),
 }
 
+# Ответ opensky_regions_catalog не меняется — собираем его один раз.
+# Объект общий для всех вызовов: не мутировать.
+_REGIONS_CATALOG: Dict[str, Any] = {
+    "ok": True,
+    "regions": [
+        {"name": name, "bbox": bbox}
+        for name, bbox in REGIONS.items()
+    ],
+    "note": "Пресеты для демо. При необходимости задавайте bbox вручную.",
+}
+
+
+# ---------------------------
+# Shared HTTP client
+# ---------------------------
+
+# Один долгоживущий клиент на процесс: пул соединений + HTTP/2,
+# чтобы вызовы tools переиспользовали уже открытое TLS-соединение.
+# Accept-Encoding httpx выставляет сам (gzip, deflate, + br при установленном
+# brotli) и сам распаковывает ответ — вручную заголовок не задаём, чтобы не
+# заявить кодек, который клиент не сможет декодировать.
+# Пул общий для всех tools. Больше ~100 соединений OpenSky всё равно не даст
+# (упрёмся в rate limit), а вот keep-alive с запасом и подольше держим,
+# чтобы редкие вызовы tools не открывали TCP+TLS заново.
+HTTP_LIMITS = httpx.Limits(
+    max_connections=CONFIG.max_connections,
+    max_keepalive_connections=min(50, CONFIG.max_connections),
+    keepalive_expiry=60.0,
+)
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Внутренний helper: общий AsyncClient (создаётся лениво)."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=CONFIG.http_timeout,
+            http2=True,
+            limits=HTTP_LIMITS,
+        )
+    return _client
+
+
+_lifespan_users = 0
+_token_refresh_task: Optional[asyncio.Task] = None
+
+
+@asynccontextmanager
+async def _lifespan(server: Any):
+    """
+    Жизненный цикл сервера:
+    - на старте запускает фоновое обновление OAuth токена (если есть креды);
+    - при остановке гасит его и закрывает общий клиент.
+    Счётчик нужен, т.к. в некоторых транспортах lifespan входит на каждую сессию.
+    """
+    global _client, _lifespan_users, _token_refresh_task
+    _lifespan_users += 1
+    if _lifespan_users == 1 and CONFIG.has_credentials:
+        _token_refresh_task = asyncio.create_task(_token_refresh_loop())
+    try:
+        yield
+    finally:
+        _lifespan_users -= 1
+        if _lifespan_users == 0:
+            if _token_refresh_task is not None:
+                _token_refresh_task.cancel()
+                try:
+                    await _token_refresh_task
+                except asyncio.CancelledError:
+                    pass
+                _token_refresh_task = None
+            if _client is not None:
+                await _client.aclose()
+                _client = None
+
 
 # ---------------------------
 # Server
 # ---------------------------
 
-mcp = FastMCP("opensky-live")
+mcp = FastMCP("opensky-live", lifespan=_lifespan)
 
 
 # ---------------------------
 # OAuth cache
 # ---------------------------
 
-_token_cache: Dict[str, Any] = {"token": None, "exp": 0.0}
+# Простые глобалы вместо dict: читаются на каждом запросе к OpenSky
+_token: Optional[str] = None
+_token_exp = 0.0
+_token_retry_at = 0.0
+_token_lock = asyncio.Lock()
+
+# Пауза перед повторной попыткой, если OAuth endpoint не ответил
+TOKEN_RETRY_AFTER = 30.0
+# За сколько секунд до истечения фоновая задача обновляет токен
+TOKEN_REFRESH_AHEAD = 120.0
+# Потолок паузы между неудачными попытками фонового обновления
+TOKEN_RETRY_MAX = 600.0
+
+
+def _cached_token(now: float) -> Optional[str]:
+    if _token and now < _token_exp:
+        return _token
+    return None
+
+
+async def _refresh_token(force: bool = False) -> Optional[str]:
+    """
+    Получает OAuth2 токен по client_credentials и кэширует его.
+    Обновление под lock: параллельные вызовы ждут один POST, а не шлют свои.
+    force=True — обновить, даже если текущий токен ещё действителен.
+    """
+    global _token, _token_exp, _token_retry_at
+    async with _token_lock:
+        # Пока ждали lock, токен мог обновить другой вызов
+        now = time.monotonic()
+        if not force:
+            token = _cached_token(now)
+            if token:
+                return token
+            if now < _token_retry_at:
+                return None
+
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": CONFIG.client_id,
+            "client_secret": CONFIG.client_secret,
+        }
+
+        try:
+            r = await _get_client().post(TOKEN_URL, data=data)
+            r.raise_for_status()
+            payload = orjson.loads(r.content)
+
+            token = payload.get("access_token")
+            expires_in = int(payload.get("expires_in", 1800))
+
+            # буфер на рассинхрон часов
+            _token = token
+            _token_exp = now + max(60, expires_in - 60)
+
+            return token
+        except Exception:
+            # Если токен не берётся — пусть дальше будет анонимный режим.
+            # Ожидающие вызовы не повторяют POST сразу же, а идут анонимно.
+            _token_retry_at = now + TOKEN_RETRY_AFTER
+            return None
 
 
 async def _get_bearer_token() -> Optional[str]:
     """
     Внутренний helper:
     - Если client_id/secret не заданы, возвращает None (анонимный режим).
-    - Иначе получает OAuth2 токен по client_credentials и кэширует его.
+    - Иначе отдаёт токен из кэша; обычно его заранее обновляет фоновая задача,
+      и сетевой запрос здесь нужен только при холодном старте.
     """
-    if not CLIENT_ID or not CLIENT_SECRET:
+    if not CONFIG.has_credentials:
         return None
 
-    now = time.time()
-    token = _token_cache.get("token")
-    exp = float(_token_cache.get("exp", 0))
-    if token and now < exp:
+    token = _cached_token(time.monotonic())
+    if token:
         return token
 
-    data = {
-        "grant_type": "client_credentials",
-        "client_id": CLIENT_ID,
-        "client_secret": CLIENT_SECRET,
-    }
-
-    try:
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
-            r = await client.post(TOKEN_URL, data=data)
-            r.raise_for_status()
-            payload = r.json()
-
-        token = payload.get("access_token")
-        expires_in = int(payload.get("expires_in", 1800))
+    return await _refresh_token()
 
-        # небольшой буфер
-        _token_cache["token"] = token
-        _token_cache["exp"] = now + max(60, expires_in - 30)
 
-        return token
-    except Exception:
-        # Если токен не берётся — пусть дальше будет анонимный режим.
-        return None
+async def _token_refresh_loop() -> None:
+    """
+    Фоновая задача: берёт токен на старте и обновляет его заранее,
+    за TOKEN_REFRESH_AHEAD до истечения — обновление не попадает в вызовы tools.
+    При ошибках повторяет с экспоненциальной паузой; старый токен, пока он
+    действителен, остаётся в кэше.
+    """
+    failures = 0
+    while True:
+        try:
+            token = await _refresh_token(force=True)
+        except Exception:
+            token = None
+
+        if token:
+            failures = 0
+            left = _token_exp - time.monotonic()
+            delay = max(left - TOKEN_REFRESH_AHEAD, left / 2)
+        else:
+            # 30, 60, 120 … секунд, но не дольше TOKEN_RETRY_MAX
+            delay = min(TOKEN_RETRY_AFTER * 2 ** failures, TOKEN_RETRY_MAX)
+            failures += 1
+        await asyncio.sleep(delay)
 
 
 # ---------------------------
@@ -123,6 +316,152 @@ def _err(where: str, kind: str, message: str, **extra: Any) -> Dict[str, Any]:
 # Low-level HTTP to OpenSky with soft errors
 # ---------------------------
 
+class _AIMDLimiter:
+    """
+    Адаптивный лимит одновременных запросов (AIMD, как окно в TCP):
+    - нормальный ответ -> лимит растёт на alpha (до c_max);
+    - 429/5xx-перегрузка, обрыв соединения или средняя задержка выше
+      latency_target -> лимит умножается на beta (не ниже c_min).
+    Слот освобождается сразу по завершении запроса — очередь идёт непрерывно.
+    """
+
+    # Статусы, которыми OpenSky сигналит о перегрузке
+    OVERLOAD_STATUSES = frozenset({429, 502, 503, 504})
+
+    def __init__(
+        self,
+        c_min: int = 1,
+        c_max: int = 16,
+        alpha: float = 0.5,
+        beta: float = 0.5,
+        latency_target: float = 2.0,
+        window: int = 20,
+    ) -> None:
+        if not 1 <= c_min <= c_max:
+            raise ValueError(f"нужно 1 <= c_min <= c_max, получено c_min={c_min}, c_max={c_max}")
+        self.c_min = c_min
+        self.c_max = c_max
+        self.alpha = alpha
+        self.beta = beta
+        self.latency_target = latency_target
+        self.limit = float(c_max)
+        self._active = 0
+        self._cond = asyncio.Condition()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._last_decrease = 0.0
+
+    async def __aenter__(self) -> "_AIMDLimiter":
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < int(self.limit))
+            self._active += 1
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def observe(self, status: int, elapsed: float) -> None:
+        """Обратная связь по завершённому запросу."""
+        if status in self.OVERLOAD_STATUSES:
+            self.backoff()
+            return
+
+        self._latencies.append(elapsed)
+        if len(self._latencies) >= 5:
+            avg = sum(self._latencies) / len(self._latencies)
+            if avg > self.latency_target:
+                self.backoff()
+                return
+
+        self.limit = min(float(self.c_max), self.limit + self.alpha)
+
+    def backoff(self) -> None:
+        """Мультипликативное снижение; не чаще раза в latency_target секунд,
+        чтобы пачка одновременных 429 не обрушила лимит до минимума."""
+        now = time.monotonic()
+        if now - self._last_decrease < self.latency_target:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.c_min), self.limit * self.beta)
+        self._latencies.clear()
+
+
+class _CircuitBreaker:
+    """
+    Предохранитель поверх AIMD: лимитер лишь сужает поток до c_min, а
+    мёртвый хост всё равно получал бы каждый вызов и держал его до таймаута.
+    - threshold отказов подряд (обрыв, таймаут, 5xx-перегрузка) -> open:
+      запросы не отправляются cooldown секунд;
+    - после cooldown -> half-open: пропускается один пробный запрос;
+    - успех пробы закрывает цепь, отказ снова открывает её на cooldown.
+    """
+
+    # 429 сюда не входит: квоту отрабатывает пауза по X-Rate-Limit-*
+    FAILURE_STATUSES = frozenset({502, 503, 504})
+
+    def __init__(self, threshold: int = 5, cooldown: float = 30.0) -> None:
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.probing = False
+        self._failures = 0
+        self._open_until = 0.0
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос. В half-open выставляет probing —
+        вызывающий, получивший True при probing, и есть проба."""
+        if self._failures < self.threshold:
+            return True
+        if self.probing or time.monotonic() < self._open_until:
+            return False
+        self.probing = True
+        return True
+
+    def retry_after(self) -> int:
+        return max(1, int(self._open_until - time.monotonic()) + 1)
+
+    def record(self, ok: bool) -> None:
+        self.probing = False
+        if ok:
+            self._failures = 0
+            return
+        self._failures += 1
+        if self._failures >= self.threshold:
+            self._open_until = time.monotonic() + self.cooldown
+
+    def end_probe(self) -> None:
+        """Проба завершилась без вердикта (отмена, свой пул, квота) —
+        следующий вызов снова сможет стать пробой."""
+        self.probing = False
+
+
+# Не больше N одновременных запросов к OpenSky: всплески иначе ловят 429.
+_opensky_limiter = _AIMDLimiter(c_min=1, c_max=CONFIG.max_concurrency)
+_opensky_breaker = _CircuitBreaker()
+
+# Квота OpenSky по заголовкам ответа: остаток кредитов и пауза после 429
+_rate_remaining: Optional[int] = None
+_rate_pause_until = 0.0
+
+# Дольше этого не ждём внутри вызова tool — сразу отдаём ошибку rate_limited
+RATE_LIMIT_MAX_WAIT = 10.0
+
+
+def _note_rate_limit(r: httpx.Response) -> None:
+    """Запоминает X-Rate-Limit-* из ответа OpenSky."""
+    global _rate_remaining, _rate_pause_until
+    remaining = r.headers.get("X-Rate-Limit-Remaining")
+    if remaining is not None and remaining.isdigit():
+        _rate_remaining = int(remaining)
+
+    retry_after = (
+        r.headers.get("X-Rate-Limit-Retry-After-Seconds")
+        or r.headers.get("Retry-After")
+    )
+    if r.status_code == 429 and retry_after and retry_after.isdigit():
+        _rate_pause_until = max(_rate_pause_until, time.monotonic() + int(retry_after))
+
+
 async def _opensky_get(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
     """
     Внутренний helper:
@@ -132,140 +471,302 @@ async def _opensky_get(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
     """
     url = f"{OPENSKY_BASE}{path}"
 
-    token = await _get_bearer_token()
-    headers = {"Accept": "application/json"}
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
+    # OpenSky подряд не отвечает — не ждём таймаут на каждом вызове
+    if not _opensky_breaker.allow():
+        return _err(
+            "opensky",
+            "circuit_open",
+            "OpenSky не отвечает, запросы временно не отправляются.",
+            retry_after=_opensky_breaker.retry_after(),
+            url=url,
+            params=params,
+        )
+    probe = _opensky_breaker.probing
 
     try:
-        async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
-            r = await client.get(url, params=params, headers=headers)
-            r.raise_for_status()
-            return {"ok": True, "data": r.json(), "url": url, "params": params}
+        token = await _get_bearer_token()
+        headers = {"Accept": "application/json"}
+        if token:
+            headers["Authorization"] = f"Bearer {token}"
+
+        async with _opensky_limiter:
+            # После 429 OpenSky сам говорит, сколько ждать: не шлём заведомо
+            # отклоняемые запросы — короткую паузу выжидаем, длинную сразу
+            # отдаём. Проверяем уже со слотом: пауза могла начаться, пока
+            # запрос стоял в очереди лимитера.
+            while (wait := _rate_pause_until - time.monotonic()) > 0:
+                if wait > RATE_LIMIT_MAX_WAIT:
+                    return _err(
+                        "opensky",
+                        "rate_limited",
+                        "Квота OpenSky исчерпана, повторите позже.",
+                        retry_after=int(wait) + 1,
+                        url=url,
+                        params=params,
+                    )
+                await asyncio.sleep(wait)
+
+            t0 = time.monotonic()
+            r = await _get_client().get(url, params=params, headers=headers)
+            _opensky_limiter.observe(r.status_code, time.monotonic() - t0)
+        _opensky_breaker.record(r.status_code not in _CircuitBreaker.FAILURE_STATUSES)
+        _note_rate_limit(r)
+        r.raise_for_status()
+        return {"ok": True, "data": orjson.loads(r.content), "url": url, "params": params}
     except httpx.ConnectError as e:
+        _opensky_limiter.backoff()
+        _opensky_breaker.record(False)
         return _err("opensky", "connect_error", str(e), url=url, params=params)
-    except httpx.ReadTimeout as e:
+    except httpx.PoolTimeout as e:
+        # Заполнен наш собственный пул, а не OpenSky — лимит не трогаем
+        return _err("opensky", "timeout", str(e), url=url, params=params)
+    except httpx.TimeoutException as e:
+        # Connect/Read/Write — хост не справляется
+        _opensky_limiter.backoff()
+        _opensky_breaker.record(False)
         return _err("opensky", "timeout", str(e), url=url, params=params)
     except httpx.HTTPStatusError as e:
         status = getattr(e.response, "status_code", None)
         return _err("opensky", "http_status", str(e), status=status, url=url, params=params)
     except Exception as e:
         return _err("opensky", "unknown", str(e), url=url, params=params)
+    finally:
+        if probe:
+            _opensky_breaker.end_probe()
+
+
+# ---------------------------
+# Response cache + single-flight
+# ---------------------------
+
+_resp_cache: Dict[Tuple, Tuple[float, Dict[str, Any]]] = {}
+_inflight: Dict[Tuple, asyncio.Future] = {}
+
+
+async def _fetch_and_cache(key: Tuple, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    try:
+        res = await _opensky_get(path, params)
+        if res.get("ok") and CONFIG.cache_ttl > 0:
+            now = time.monotonic()
+            # Ленивая чистка: разные bbox не должны копиться в памяти бесконечно
+            for k in [k for k, (exp, _) in _resp_cache.items() if exp <= now]:
+                del _resp_cache[k]
+            _resp_cache[key] = (now + CONFIG.cache_ttl, res)
+        return res
+    finally:
+        _inflight.pop(key, None)
+
+
+async def _cached_get(path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Внутренний helper: GET к OpenSky с коротким TTL-кэшем.
+    Нужен bbox-инструментам: live/normalized/summary по одному bbox подряд
+    дают один HTTP-вызов, а одинаковые параллельные запросы ждут общий.
+    Диагностика ходит мимо кэша — через _opensky_get.
+    Результат общий для всех вызывающих — не мутировать
+    (исключение — memo "rows" в _state_rows_bbox).
+    """
+    key = (path, tuple(sorted(params.items())))
+
+    hit = _resp_cache.get(key)
+    if hit is not None:
+        if time.monotonic() < hit[0]:
+            return hit[1]
+        del _resp_cache[key]
+
+    fut = _inflight.get(key)
+    if fut is None:
+        fut = asyncio.ensure_future(_fetch_and_cache(key, path, params))
+        _inflight[key] = fut
+
+    # shield: отмена одного вызывающего не должна отменять запрос для остальных
+    return await asyncio.shield(fut)
 
 
 # ---------------------------
 # Normalization helpers
 # ---------------------------
 
-def _to_kmh(v_ms: Optional[float]) -> Optional[float]:
-    return None if v_ms is None else v_ms * 3.6
+# Коэффициенты пересчёта единиц
+_MS_TO_KMH = 3.6
+_M_TO_FT = 3.28084
+
+# Нормализованный state хранится как кортеж с фиксированным порядком полей:
+#   icao24, callsign, origin_country, lat, lon, alt_ft, speed_kmh,
+#   track_deg, on_ground, last_contact, префикс позывного (для сводки).
+# Заметно компактнее dict, а сортировки идут по индексу через itemgetter.
+# В dict превращаем только то, что реально уходит в ответ tool.
+# Порядок задают _state_rows и _rows_to_dicts — менять их вместе с индексами ниже.
+_IDX_ALT_FT = 5
+_IDX_SPEED_KMH = 6
+_IDX_CALLSIGN_PREFIX = 10
+
+StateRow = Tuple[Any, ...]
 
-def _to_ft(alt_m: Optional[float]) -> Optional[float]:
-    return None if alt_m is None else alt_m * 3.28084
 
-def _normalize_states(raw: Dict[str, Any]) -> List[Dict[str, Any]]:
+def _state_rows(raw: Dict[str, Any]) -> List[StateRow]:
     """
     Нормализует ответ OpenSky /states/all:
     states — список массивов с фиксированными индексами.
-    Возвращает список объектов с понятными полями.
+    Возвращает список кортежей StateRow (порядок полей — см. выше).
     """
     states = raw.get("states") or []
-    out: List[Dict[str, Any]] = []
+    out: List[StateRow] = []
+    append = out.append
 
+    # Один проход: сначала отсев без координат, затем пересчёт единиц inline
     for s in states:
         # Индексы OpenSky states
-        icao24 = s[0]
-        callsign = (s[1] or "").strip() or "UNKNOWN"
-        origin_country = s[2]
-        last_contact = s[4]
         lon = s[5]
         lat = s[6]
+        if lat is None or lon is None:
+            continue
+
+        callsign = (s[1] or "").strip() or "UNKNOWN"
         baro_alt_m = s[7]
-        on_ground = s[8]
         velocity_ms = s[9]
-        true_track = s[10]
 
-        if lat is None or lon is None:
-            continue
+        append((
+            s[0],                                   # icao24
+            callsign,
+            s[2],                                   # origin_country
+            lat,
+            lon,
+            None if baro_alt_m is None else baro_alt_m * _M_TO_FT,
+            None if velocity_ms is None else velocity_ms * _MS_TO_KMH,
+            s[10],                                  # track_deg
+            s[8],                                   # on_ground
+            s[4],                                   # last_contact
+            callsign[:3] if callsign != "UNKNOWN" else "UNK",
+        ))
+
+    return out
+
 
-        out.append({
+def _rows_to_dicts(rows: List[StateRow]) -> List[Dict[str, Any]]:
+    """Материализует кортежи _state_rows в объекты с понятными полями."""
+    return [
+        {
             "icao24": icao24,
             "callsign": callsign,
             "origin_country": origin_country,
             "lat": lat,
             "lon": lon,
-            "alt_ft": _to_ft(baro_alt_m),
-            "speed_kmh": _to_kmh(velocity_ms),
-            "track_deg": true_track,
+            "alt_ft": alt_ft,
+            "speed_kmh": speed_kmh,
+            "track_deg": track_deg,
             "on_ground": on_ground,
             "last_contact": last_contact,
-        })
-
-    return out
+        }
+        for (
+            icao24, callsign, origin_country, lat, lon,
+            alt_ft, speed_kmh, track_deg, on_ground, last_contact, _prefix,
+        ) in rows
+    ]
 
 
-async def _normalized_states_bbox(
-    lamin: float, lomin: float, lamax: float, lomax: float
-) -> Dict[str, Any]:
-    """Внутренний helper без декораторов — чтобы tool не вызывал tool."""
-    params = {"lamin": lamin, "lomin": lomin, "lamax": lamax, "lomax": lomax}
-    raw = await _opensky_get("/states/all", params)
+async def _state_rows_bbox(bbox: Dict[str, float]) -> Dict[str, Any]:
+    """Внутренний helper: bbox -> {"ok", "bbox", "rows"} или ошибка."""
+    raw = await _cached_get("/states/all", bbox)
 
     if not raw.get("ok"):
         return raw
 
-    items = _normalize_states(raw["data"])
+    # Ответ из кэша общий: разобранные строки кладём рядом с ним,
+    # чтобы повторные normalized/summary в пределах TTL не парсили заново.
+    rows = raw.get("rows")
+    if rows is None:
+        rows = raw["rows"] = _state_rows(raw["data"])
+
+    return {"ok": True, "bbox": bbox, "rows": rows}
+
+
+async def _normalized_states_bbox(bbox: Dict[str, float]) -> Dict[str, Any]:
+    """Внутренний helper без декораторов — чтобы tool не вызывал tool."""
+    data = await _state_rows_bbox(bbox)
+
+    if not data.get("ok"):
+        return data
+
+    items = _rows_to_dicts(data["rows"])
     return {
         "ok": True,
-        "bbox": params,
+        "bbox": data["bbox"],
         "count": len(items),
         "states": items,
     }
 
 
-async def _airspace_summary_bbox(
-    lamin: float, lomin: float, lamax: float, lomax: float, top_n: int = 5
-) -> Dict[str, Any]:
+async def _airspace_summary_bbox(bbox: Dict[str, float], top_n: int = 5) -> Dict[str, Any]:
     """Внутренний helper: сводка по bbox."""
-    data = await _normalized_states_bbox(lamin, lomin, lamax, lomax)
+    data = await _state_rows_bbox(bbox)
 
     if not data.get("ok"):
         return data
 
-    states = data["states"]
+    rows = data["rows"]
 
-    by_speed = sorted(
-        [s for s in states if s.get("speed_kmh") is not None],
-        key=lambda x: x["speed_kmh"],
-        reverse=True,
-    )[:top_n]
-
-    by_alt = sorted(
-        [s for s in states if s.get("alt_ft") is not None],
-        key=lambda x: x["alt_ft"],
-        reverse=True,
-    )[:top_n]
+    # nlargest держит кучу из top_n элементов: O(N log top_n) вместо полной сортировки
+    by_speed = heapq.nlargest(
+        top_n,
+        [r for r in rows if r[_IDX_SPEED_KMH] is not None],
+        key=itemgetter(_IDX_SPEED_KMH),
+    )
 
-    prefixes: Dict[str, int] = {}
-    for s in states:
-        cs = s.get("callsign") or "UNKNOWN"
-        p = cs[:3] if cs != "UNKNOWN" else "UNK"
-        prefixes[p] = prefixes.get(p, 0) + 1
+    by_alt = heapq.nlargest(
+        top_n,
+        [r for r in rows if r[_IDX_ALT_FT] is not None],
+        key=itemgetter(_IDX_ALT_FT),
+    )
 
-    top_prefixes = sorted(prefixes.items(), key=lambda x: x[1], reverse=True)[:top_n]
+    # Префиксы посчитаны ещё при нормализации — второй проход по строкам не нужен
+    prefixes = Counter(map(itemgetter(_IDX_CALLSIGN_PREFIX), rows))
+    top_prefixes = prefixes.most_common(top_n)
 
     return {
         "ok": True,
         "bbox": data["bbox"],
-        "count": data["count"],
-        "top_by_speed": by_speed,
-        "top_by_altitude": by_alt,
+        "count": len(rows),
+        "top_by_speed": _rows_to_dicts(by_speed),
+        "top_by_altitude": _rows_to_dicts(by_alt),
         "top_callsign_prefixes": top_prefixes,
         "note": "Живой срез OpenSky на текущий момент.",
         "disclaimer": "origin_country — это страна регистрации ICAO24, а не маршрут рейса.",
     }
 
 
+# ---------------------------
+# Diagnostics helper
+# ---------------------------
+
+async def _probe(
+    method: str,
+    url: str,
+    extra: Optional[Dict[str, Any]] = None,
+    timeout: float = 10,
+    **kw: Any,
+) -> Dict[str, Any]:
+    """
+    Внутренний helper диагностики: один запрос через общий клиент
+    (HTTP/2, те же пулы соединений, что и у tools) с замером времени.
+    Исключения не пробрасывает — возвращает ok=false с типом ошибки.
+    """
+    t0 = time.monotonic()
+    try:
+        r = await _get_client().request(method, url, timeout=timeout, **kw)
+        d = {"ok": True, "url": url, "status": r.status_code, "ms": int((time.monotonic()-t0)*1000)}
+    except Exception as e:
+        d = {
+            "ok": False,
+            "url": url,
+            "error_type": type(e).__name__,
+            "detail": str(e) or "",
+        }
+    if extra:
+        d.update(extra)
+    return d
+
+
 # ---------------------------
 # MCP tools
 # ---------------------------
@@ -289,107 +790,58 @@ async def opensky_ping_plus(
     - opensky_auth ok=false при наличии кредов -> проблема OAuth2 из этого окружения
     """
 
-    import os
-    import time
-    import httpx
-
     OPENSKY_DOMAIN_URL = "https://opensky-network.org/"
-    OPENSKY_API_URL = "https://opensky-network.org/api/states/all"
-    OPENSKY_AUTH_URL = (
-        "https://auth.opensky-network.org/auth/realms/opensky-network/"
-        "protocol/openid-connect/token"
-    )
+    OPENSKY_API_URL = f"{OPENSKY_BASE}/states/all"
+    OPENSKY_AUTH_URL = TOKEN_URL
 
     opensky_params = {
         "lamin": 55.2, "lomin": 36.9,
         "lamax": 56.1, "lomax": 38.3
     }
 
-    def ok_result(url: str, status: int, ms: int, extra: dict | None = None):
-        d = {"ok": True, "url": url, "status": status, "ms": ms}
-        if extra:
-            d.update(extra)
-        return d
-
-    def err_result(url: str, e: Exception, extra: dict | None = None):
-        d = {
-            "ok": False,
-            "url": url,
-            "error_type": type(e).__name__,
-            "detail": str(e) or "",
-        }
-        if extra:
-            d.update(extra)
-        return d
-
-    results = {}
-
-    client_id = os.getenv("OPENSKY_CLIENT_ID")
-    client_secret = os.getenv("OPENSKY_CLIENT_SECRET")
-
-    async with httpx.AsyncClient(timeout=10, follow_redirects=True) as client:
+    probe_kw: Dict[str, Any] = {"follow_redirects": True}
 
+    probes = {
         # 1) Generic интернет
-        t0 = time.time()
-        try:
-            r = await client.get(generic_url)
-            results["generic"] = ok_result(generic_url, r.status_code, int((time.time()-t0)*1000))
-        except Exception as e:
-            results["generic"] = err_result(generic_url, e)
-
+        "generic": _probe("GET", generic_url, **probe_kw),
         # 2) Статический ресурс OpenSky
-        t1 = time.time()
-        try:
-            r = await client.get(OPENSKY_DOMAIN_URL)
-            results["opensky_domain"] = ok_result(OPENSKY_DOMAIN_URL, r.status_code, int((time.time()-t1)*1000))
-        except Exception as e:
-            results["opensky_domain"] = err_result(OPENSKY_DOMAIN_URL, e)
-
-        # 3) OAuth2 token endpoint (если есть креды)
-        if client_id and client_secret:
-            t2 = time.time()
-            try:
-                data = {
-                    "grant_type": "client_credentials",
-                    "client_id": client_id,
-                    "client_secret": client_secret,
-                }
-                r = await client.post(
-                    OPENSKY_AUTH_URL,
-                    data=data,
-                    headers={"Content-Type": "application/x-www-form-urlencoded"},
-                )
-                results["opensky_auth"] = ok_result(
-                    OPENSKY_AUTH_URL,
-                    r.status_code,
-                    int((time.time()-t2)*1000),
-                )
-            except Exception as e:
-                results["opensky_auth"] = err_result(OPENSKY_AUTH_URL, e)
-        else:
-            results["opensky_auth"] = {
-                "ok": False,
-                "skipped": True,
-                "reason": "Missing OPENSKY_CLIENT_ID/OPENSKY_CLIENT_SECRET",
-                "url": OPENSKY_AUTH_URL,
-            }
-
+        "opensky_domain": _probe("GET", OPENSKY_DOMAIN_URL, **probe_kw),
         # 4) API OpenSky
-        t3 = time.time()
-        try:
-            r = await client.get(OPENSKY_API_URL, params=opensky_params)
-            results["opensky_api"] = ok_result(
-                OPENSKY_API_URL,
-                r.status_code,
-                int((time.time()-t3)*1000),
-                extra={"params": opensky_params},
-            )
-        except Exception as e:
-            results["opensky_api"] = err_result(
-                OPENSKY_API_URL,
-                e,
-                extra={"params": opensky_params},
-            )
+        "opensky_api": _probe(
+            "GET",
+            OPENSKY_API_URL,
+            params=opensky_params,
+            extra={"params": opensky_params},
+            **probe_kw,
+        ),
+    }
+    # 3) OAuth2 token endpoint (если есть креды)
+    if CONFIG.has_credentials:
+        probes["opensky_auth"] = _probe(
+            "POST",
+            OPENSKY_AUTH_URL,
+            data={
+                "grant_type": "client_credentials",
+                "client_id": CONFIG.client_id,
+                "client_secret": CONFIG.client_secret,
+            },
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            **probe_kw,
+        )
+
+    # Пробы независимы — запускаем параллельно: общее время ≈ самой медленной
+    done = dict(zip(probes, await asyncio.gather(*probes.values())))
+    results = {
+        "generic": done["generic"],
+        "opensky_domain": done["opensky_domain"],
+        "opensky_auth": done.get("opensky_auth") or {
+            "ok": False,
+            "skipped": True,
+            "reason": "Missing OPENSKY_CLIENT_ID/OPENSKY_CLIENT_SECRET",
+            "url": OPENSKY_AUTH_URL,
+        },
+        "opensky_api": done["opensky_api"],
+    }
 
     # Вердикт
     if not results["generic"]["ok"]:
@@ -428,22 +880,17 @@ def opensky_regions_catalog() -> Dict[str, Any]:
     Возвращает:
     - regions: список объектов {name, bbox}.
     """
-    return {
-        "ok": True,
-        "regions": [
-            {
-                "name": name,
-                "bbox": {"lamin": box[0], "lomin": box[1], "lamax": box[2], "lomax": box[3]},
-            }
-            for name, box in REGIONS.items()
-        ],
-        "note": "Пресеты для демо. При необходимости задавайте bbox вручную.",
-    }
+    return _REGIONS_CATALOG
 
 
 @mcp.tool
 async def opensky_live_states_bbox(
-    lamin: float, lomin: float, lamax: float, lomax: float, extended: int = 0
+    lamin: float,
+    lomin: float,
+    lamax: float,
+    lomax: float,
+    extended: int = 0,
+    fields: Optional[List[int]] = None,
 ) -> Dict[str, Any]:
     """
     Сырые живые данные OpenSky по bbox.
@@ -455,25 +902,66 @@ async def opensky_live_states_bbox(
     Параметры:
     - lamin/lomin/lamax/lomax: границы области.
     - extended: 0/1 — запрос расширенного формата states (если доступен).
+    - fields: индексы полей state vector, которые оставить в каждой строке
+      (например [0, 1, 5, 6] — icao24, callsign, lon, lat). По умолчанию — все;
+      пустой список — ошибка bad_fields.
+      Сокращает объём ответа.
 
     Возвращает:
-    - ok=true + raw исходного ответа OpenSky,
+    - ok=true + raw исходного ответа OpenSky (states — только выбранные поля),
       либо ok=false + подробная ошибка.
     """
-    params: Dict[str, Any] = {"lamin": lamin, "lomin": lomin, "lamax": lamax, "lomax": lomax}
+    params: Dict[str, Any] = _bbox(lamin, lomin, lamax, lomax)
     if extended:
         params["extended"] = 1
 
-    raw = await _opensky_get("/states/all", params)
+    if fields is not None:
+        if not fields:
+            return _err(
+                "server",
+                "bad_fields",
+                "fields не может быть пустым: не передавайте его, чтобы получить все поля.",
+                fields=fields,
+            )
+        if any(i < 0 for i in fields):
+            return _err(
+                "server",
+                "bad_fields",
+                "Индексы fields должны быть неотрицательными.",
+                fields=fields,
+            )
+
+    raw = await _cached_get("/states/all", params)
     if not raw.get("ok"):
         return raw
 
-    return {
+    data = raw["data"]
+    if fields is not None:
+        # Ответ общий для кэша — проецируем в новый объект, а не на месте
+        states = data.get("states")
+        try:
+            projected = (
+                None if states is None
+                else [[row[i] for i in fields] for row in states]
+            )
+        except IndexError:
+            return _err(
+                "server",
+                "bad_fields",
+                "Индекс в fields выходит за длину state vector.",
+                fields=fields,
+            )
+        data = {**data, "states": projected}
+
+    out: Dict[str, Any] = {
         "ok": True,
         "bbox": params,
-        "raw": raw["data"],
+        "raw": data,
         "note": "Сырые данные OpenSky /states/all.",
     }
+    if fields is not None:
+        out["fields"] = fields
+    return out
 
 
 @mcp.tool
@@ -495,7 +983,7 @@ async def opensky_normalized_states_bbox(
       alt_ft (может отсутствовать), speed_kmh (может отсутствовать),
       track_deg, on_ground, last_contact.
     """
-    return await _normalized_states_bbox(lamin, lomin, lamax, lomax)
+    return await _normalized_states_bbox(_bbox(lamin, lomin, lamax, lomax))
 
 
 @mcp.tool
@@ -514,7 +1002,7 @@ async def opensky_airspace_summary_bbox(
     - ok=true + count + лидеры + префиксы,
       либо ok=false + подробная ошибка.
     """
-    return await _airspace_summary_bbox(lamin, lomin, lamax, lomax, top_n=top_n)
+    return await _airspace_summary_bbox(_bbox(lamin, lomin, lamax, lomax), top_n=top_n)
 
 
 @mcp.tool
@@ -537,8 +1025,7 @@ async def opensky_airspace_summary_region(region: str, top_n: int = 5) -> Dict[s
             available=list(REGIONS.keys()),
         )
 
-    lamin, lomin, lamax, lomax = REGIONS[region]
-    return await _airspace_summary_bbox(lamin, lomin, lamax, lomax, top_n=top_n)
+    return await _airspace_summary_bbox(REGIONS[region], top_n=top_n)
 
 
 @mcp.tool
@@ -554,23 +1041,10 @@ async def net_healthcheck() -> Dict[str, Any]:
         "https://httpbin.org/get",
     ]
 
-    results = []
-    try:
-        async with httpx.AsyncClient(timeout=10) as client:
-            for url in targets:
-                try:
-                    r = await client.get(url)
-                    results.append({"url": url, "ok": True, "status": r.status_code})
-                except Exception as e:
-                    results.append({
-                        "url": url,
-                        "ok": False,
-                        "error_type": type(e).__name__,
-                        "detail": str(e),
-                    })
-        return {"ok": True, "results": results}
-    except Exception as e:
-        return _err("network", "healthcheck_failed", str(e))
+    # Цели независимы — опрашиваем параллельно, порядок результатов сохраняется.
+    # _probe сам превращает ошибки в ok=false, поэтому gather не падает.
+    results = await asyncio.gather(*(_probe("GET", url) for url in targets))
+    return {"ok": True, "results": results}
 
 
 @mcp.tool
@@ -580,6 +1054,7 @@ async def opensky_healthcheck() -> Dict[str, Any]:
 
     Делает тестовый запрос /states/all по небольшому bbox.
     Полезно отличать проблему OpenSky от общего запрета egress.
+    rate_limit_remaining — остаток кредитов API по последнему ответу (если OpenSky его прислал).
     """
     params = {"lamin": 55.5, "lomin": 37.2, "lamax": 55.9, "lomax": 37.8}
     raw = await _opensky_get("/states/all", params)
@@ -592,10 +1067,11 @@ async def opensky_healthcheck() -> Dict[str, Any]:
         "ok": True,
         "time": data.get("time"),
         "states_is_null": data.get("states") is None,
+        "rate_limit_remaining": _rate_remaining,
         "note": "Если states_is_null=true — это может быть отсутствие покрытия в данный момент.",
     }
 
 
 
 if __name__ == "__main__":
-    mcp.run(transport="http", host="0.0.0.0", port=port)
+    mcp.run(transport="http", host="0.0.0.0", port=CONFIG.port)